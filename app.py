@@ -1,24 +1,211 @@
 import streamlit as st
 import os
 import json
+import asyncio
+import copy
+import hashlib
+import html
+import io
+import math
+import shelve
+import sys
+import threading
+import time
+import zipfile
+import xml.etree.ElementTree as ElementTree
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
 import anthropic
+from anthropic.types.message_create_params import MessageCreateParamsNonStreaming
+from anthropic.types.messages.batch_create_params import Request
 import pandas as pd
-import PyPDF2
+import pypdf
 import docx
+import orjson
 import requests
+from cachetools import TTLCache
+from requests.adapters import HTTPAdapter
+from urllib3.util.request import ACCEPT_ENCODING
+from urllib3.util.retry import Retry
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 from typing import Dict, List, Any, Tuple
-import matplotlib.pyplot as plt
 
 # Constants
 THEIRSTACK_API_URL = "https://api.theirstack.com"
+THEIRSTACK_PAGE_SIZE = 25
+THEIRSTACK_MAX_PAGES = 5
+THEIRSTACK_MAX_CONCURRENCY = 8  # Concurrent page requests, to stay within rate limits
+THEIRSTACK_TIMEOUT = (5, 30)  # (connect, read) seconds, so a stalled connection can't hang a search
+# Date Posted option -> posted_at_max_age_days; anything else falls back to 90 days
+DATE_POSTED_MAX_AGE_DAYS = {"Last 24 hours": 1, "Last 7 days": 7, "Last 30 days": 30}
+SENIORITY_LEVELS = frozenset({"entry", "mid", "senior"})
+API_TEST_CACHE_SECONDS = 60
+CLAUDE_MODEL = "claude-3-5-haiku-latest"
+CLAUDE_MAX_OUTPUT_TOKENS = 8192
+RESUME_MAX_TOKENS = 600  # Output budget per analyzed resume; the structured analysis is ~300 tokens
+MAX_RESUME_BATCH_SIZE = 5  # Resumes packed into one request; larger prompts respond noticeably slower
+BATCH_POLL_INTERVAL = 10  # Seconds between Message Batches status checks
+BATCH_POLL_TIMEOUT = 120  # Longest the bulk-mode UI waits on a batch before giving up for now
+RESUME_CACHE_PATH = os.path.join(".cache", "resume")
+MAX_RESUME_CHARS = 20000  # Stop extracting PDF pages past this; more text is never useful to the analyzer
+LARGE_DOCX_BYTES = 1024 * 1024
+DOCX_NAMESPACE = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+RESUME_SYSTEM_PROMPT = """
+You are an expert resume analyzer. Extract the following information from the resume:
+1. Technical skills
+2. Soft skills
+3. Years of experience
+4. Education
+5. Key achievements
+
+Record the analysis with the record_resume tool.
+"""
+
+RESUME_BATCH_SYSTEM_PROMPT = """
+You are an expert resume analyzer. The user message contains several resumes,
+each wrapped in <doc id="N"> tags. Extract the following information from every resume:
+1. Technical skills
+2. Soft skills
+3. Years of experience
+4. Education
+5. Key achievements
+
+Record one result per resume, tagged with its doc id, using the record_resumes tool.
+"""
+
+JOB_CARD_TEMPLATE = """<div class="job-card">
+<h3>{title} at {company}</h3>
+<p>Location: {location}</p>
+<p>Match Score: <span class="match-score">{match_score}%</span></p>
+</div>"""
+
+# Tool definition used to get the analysis back as structured JSON
+RESUME_TOOL = {
+    "name": "record_resume",
+    "description": "Record the structured analysis of a resume",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "technical_skills": {"type": "array", "items": {"type": "string"}},
+            "soft_skills": {"type": "array", "items": {"type": "string"}},
+            "years_experience": {"type": "number"},
+            "education": {"type": "array", "items": {"type": "string"}},
+            "achievements": {"type": "array", "items": {"type": "string"}},
+            "seniority_level": {"type": "string", "enum": ["entry", "mid", "senior"]}
+        },
+        "required": [
+            "technical_skills", "soft_skills", "years_experience",
+            "education", "achievements", "seniority_level"
+        ]
+    }
+}
+
+# Batched variant of RESUME_TOOL: one result per <doc id="N"> in the request
+RESUME_BATCH_TOOL = {
+    "name": "record_resumes",
+    "description": "Record the structured analysis of each resume",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "results": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "id": {"type": "integer"},
+                        **RESUME_TOOL["input_schema"]["properties"]
+                    },
+                    "required": ["id", *RESUME_TOOL["input_schema"]["required"]]
+                }
+            }
+        },
+        "required": ["results"]
+    }
+}
+
+# Process-wide shared objects are built in st.cache_resource factories: Streamlit
+# re-executes this script on every rerun, so plain module globals would be rebuilt.
+
+@st.cache_resource(show_spinner=False)
+def get_session() -> requests.Session:
+    """
+    Shared HTTP session so TheirStack calls reuse pooled keep-alive connections
+    
+    The TheirStack search is a read-only POST, so it is safe to retry.
+    """
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(
+        pool_connections=8,
+        pool_maxsize=16,
+        max_retries=Retry(
+            total=3,
+            backoff_factor=0.5,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=frozenset({"GET", "POST"}),
+            raise_on_status=False
+        )
+    ))
+    return session
+
+@st.cache_resource(show_spinner=False)
+def get_theirstack_caches() -> Tuple[TTLCache, TTLCache, threading.Lock]:
+    """
+    TheirStack responses keyed by (api key hash, query JSON)
+    
+    Listings don't change second to second, so searches are reused for 10
+    minutes and API tests for 1 minute. Both caches share one lock because
+    TTLCache is not thread-safe.
+    
+    Returns:
+        tuple: (search_cache, api_test_cache, lock)
+    """
+    return (
+        TTLCache(maxsize=256, ttl=600),
+        TTLCache(maxsize=16, ttl=API_TEST_CACHE_SECONDS),
+        threading.Lock()
+    )
+
+@st.cache_resource(show_spinner=False)
+def get_executor() -> ThreadPoolExecutor:
+    """
+    Process-wide pool for file parsing
+    
+    Large uploads don't block the script thread, and several uploads parse in
+    parallel (PDF/zlib decoding releases the GIL).
+    """
+    return ThreadPoolExecutor(max_workers=4)
+
+@st.cache_resource(show_spinner=False)
+def get_resume_cache_lock() -> threading.Lock:
+    """shelve is not safe for concurrent access from Streamlit's session threads"""
+    return threading.Lock()
 
 def test_theirstack_api(api_key):
     """
     Test the TheirStack API with a minimal query to verify connectivity
     
+    Results are cached for API_TEST_CACHE_SECONDS per API key so repeated
+    clicks don't hit the API.
+    
     Returns:
-        tuple: (success, message)
+        tuple: (success, message, checked_at) where checked_at is the
+            time.time() of the request that produced the result
     """
+    _, api_test_cache, cache_lock = get_theirstack_caches()
+    cache_key = hashlib.sha256(api_key.encode()).hexdigest()
+    with cache_lock:
+        cached = api_test_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    
+    result = (*_run_theirstack_api_test(api_key), time.time())
+    with cache_lock:
+        api_test_cache[cache_key] = result
+    return result
+
+def _run_theirstack_api_test(api_key):
+    """Send the minimal TheirStack query used by test_theirstack_api"""
     headers = {
         "Authorization": f"Bearer {api_key}",
         "Content-Type": "application/json"
@@ -30,10 +217,11 @@ def test_theirstack_api(api_key):
     }
     
     try:
-        response = requests.post(
+        response = get_session().post(
             f"{THEIRSTACK_API_URL}/jobs/search",
             headers=headers,
-            json=test_query
+            json=test_query,
+            timeout=THEIRSTACK_TIMEOUT
         )
         
         if response.status_code == 200:
@@ -43,158 +231,446 @@ def test_theirstack_api(api_key):
     except Exception as e:
         return False, f"Connection error: {str(e)}"
 
+def normalize_skills(skills: List[str]) -> List[str]:
+    """Lowercase, strip, dedupe and intern skill names so set lookups compare interned strings"""
+    return list(dict.fromkeys(sys.intern(skill.strip().lower()) for skill in skills))
+
+def _is_complete_analysis(analysis: Dict) -> bool:
+    """Check that an analysis has every field RESUME_TOOL requires (a cut-off reply may not)"""
+    return isinstance(analysis, dict) and all(
+        field in analysis for field in RESUME_TOOL["input_schema"]["required"]
+    )
+
+def _resume_cache_key(resume_text: str, system_prompt: str = RESUME_SYSTEM_PROMPT,
+                      tool: Dict = RESUME_TOOL) -> str:
+    """Build a cache key from the resume content, model, system prompt and tool schema"""
+    prompt = system_prompt + json.dumps(tool, sort_keys=True)
+    prompt_hash = hashlib.sha256(prompt.encode()).hexdigest()
+    text_hash = hashlib.sha256(resume_text.encode()).hexdigest()
+    return f"{CLAUDE_MODEL}:{prompt_hash}:{text_hash}"
+
+def _load_cached_analysis(key: str) -> Dict:
+    """Look up an analysis in st.session_state, then in the on-disk shelve store"""
+    session_cache = st.session_state.setdefault("_resume_cache", {})
+    if key in session_cache:
+        return session_cache[key]
+    
+    os.makedirs(os.path.dirname(RESUME_CACHE_PATH), exist_ok=True)
+    with get_resume_cache_lock(), shelve.open(RESUME_CACHE_PATH) as disk_cache:
+        analysis = disk_cache.get(key)
+    
+    # Ignore incomplete entries written before analyses were validated
+    if not _is_complete_analysis(analysis):
+        return None
+    
+    session_cache[key] = analysis
+    return analysis
+
+def _store_cached_analysis(key: str, analysis: Dict) -> None:
+    """Write an analysis to both the session and on-disk caches"""
+    with get_resume_cache_lock(), shelve.open(RESUME_CACHE_PATH) as disk_cache:
+        disk_cache[key] = analysis
+    st.session_state.setdefault("_resume_cache", {})[key] = analysis
+
+def cache_resume_analysis(func):
+    """
+    Memoize resume analyses by content hash so repeat uploads skip the Claude call.
+    
+    Lookups go to st.session_state first, then to an on-disk shelve store.
+    Failed analyses (None) are never cached.
+    """
+    @wraps(func)
+    def wrapper(self, resume_text: str) -> Dict:
+        key = _resume_cache_key(resume_text)
+        analysis = _load_cached_analysis(key)
+        
+        if analysis is None:
+            analysis = func(self, resume_text)
+            if analysis is None:
+                return None
+            _store_cached_analysis(key, analysis)
+        
+        return analysis
+    return wrapper
+
 class ResumeAnalyzer:
     def __init__(self, api_key: str):
         self.client = anthropic.Anthropic(api_key=api_key)
         
+    @staticmethod
+    def _analysis_params(resume_text: str) -> MessageCreateParamsNonStreaming:
+        """Build the Messages API parameters for analyzing a single resume"""
+        return {
+            "model": CLAUDE_MODEL,
+            "max_tokens": RESUME_MAX_TOKENS,
+            "temperature": 0.0,
+            # The system prompt never changes, so let Anthropic serve it from prompt cache
+            "system": [{
+                "type": "text",
+                "text": RESUME_SYSTEM_PROMPT,
+                "cache_control": {"type": "ephemeral"}
+            }],
+            "tools": [RESUME_TOOL],
+            "tool_choice": {"type": "tool", "name": RESUME_TOOL["name"]},
+            "messages": [{"role": "user", "content": resume_text}]
+        }
+    
+    @cache_resume_analysis
     def analyze_resume(self, resume_text: str) -> Dict:
         """Analyze resume using Claude to extract skills and experience"""
-        system_prompt = """
-        You are an expert resume analyzer. Extract the following information from the resume:
-        1. Technical skills
-        2. Soft skills
-        3. Years of experience
-        4. Education
-        5. Key achievements
-        
-        Return the analysis in this JSON format:
-        {
-            "technical_skills": [],
-            "soft_skills": [],
-            "years_experience": number,
-            "education": [],
-            "achievements": [],
-            "seniority_level": "entry/mid/senior"
-        }
-        """
-        
         try:
-            response = self.client.messages.create(
-                model="claude-3-opus-20240229",
-                max_tokens=2000,
-                temperature=0.0,
-                system=system_prompt,
-                messages=[{"role": "user", "content": resume_text}]
-            )
-            return json.loads(response.content[0].text)
+            response = self.client.messages.create(**self._analysis_params(resume_text))
         except Exception as e:
             st.error(f"Error analyzing resume: {e}")
             return None
+        
+        # Returning None keeps truncated or incomplete analyses out of the cache
+        if response.stop_reason == "max_tokens":
+            st.error("Error analyzing resume: the response was cut off before the analysis was complete")
+            return None
+        
+        analysis = next((block.input for block in response.content if block.type == "tool_use"), None)
+        if not _is_complete_analysis(analysis):
+            st.error("Error analyzing resume: the analysis is missing required fields")
+            return None
+        return analysis
+    
+    def analyze_resumes_batch(self, resume_texts: List[str]) -> List[Dict]:
+        """
+        Analyze several resumes, packing up to MAX_RESUME_BATCH_SIZE into each Claude request
+        
+        Resumes already in the analysis cache (shared with analyze_resume) are not
+        resent, and skills are normalized as for a single analysis. Batched results
+        are cached under the batch prompt and tool, and only when complete.
+        
+        Returns:
+            list: One analysis per input resume in input order (None where analysis failed)
+        """
+        keys = [
+            _resume_cache_key(text, RESUME_BATCH_SYSTEM_PROMPT, RESUME_BATCH_TOOL)
+            for text in resume_texts
+        ]
+        analyses = [
+            _load_cached_analysis(key) or _load_cached_analysis(_resume_cache_key(text))
+            for key, text in zip(keys, resume_texts)
+        ]
+        pending = [doc_id for doc_id, analysis in enumerate(analyses) if analysis is None]
+        
+        for start in range(0, len(pending), MAX_RESUME_BATCH_SIZE):
+            chunk = pending[start:start + MAX_RESUME_BATCH_SIZE]
+            docs = "".join(f'<doc id="{doc_id}">{resume_texts[doc_id]}</doc>' for doc_id in chunk)
+            
+            try:
+                response = self.client.messages.create(
+                    model=CLAUDE_MODEL,
+                    max_tokens=min(RESUME_MAX_TOKENS * len(chunk), CLAUDE_MAX_OUTPUT_TOKENS),
+                    temperature=0.0,
+                    system=[{
+                        "type": "text",
+                        "text": RESUME_BATCH_SYSTEM_PROMPT,
+                        "cache_control": {"type": "ephemeral"}
+                    }],
+                    tools=[RESUME_BATCH_TOOL],
+                    tool_choice={"type": "tool", "name": RESUME_BATCH_TOOL["name"]},
+                    messages=[{"role": "user", "content": docs}]
+                )
+                if response.stop_reason == "max_tokens":
+                    raise ValueError("the response was cut off before the analysis was complete")
+                results = next(
+                    block.input for block in response.content if block.type == "tool_use"
+                )["results"]
+            except Exception as e:
+                st.error(f"Error analyzing resumes {', '.join(map(str, chunk))}: {e}")
+                continue
+            
+            for result in results:
+                doc_id = result.pop("id", None)
+                if isinstance(doc_id, int) and doc_id in chunk and _is_complete_analysis(result):
+                    analyses[doc_id] = result
+                    _store_cached_analysis(keys[doc_id], result)
+            
+            incomplete = [doc_id for doc_id in chunk if analyses[doc_id] is None]
+            if incomplete:
+                st.error(f"Error analyzing resumes {', '.join(map(str, incomplete))}: "
+                         "the analysis is missing required fields")
+        
+        # Normalized after caching, since interning doesn't survive pickling
+        for analysis in analyses:
+            if analysis:
+                analysis["technical_skills"] = normalize_skills(analysis.get("technical_skills", []))
+        return analyses
+    
+    def submit_batch(self, resume_texts: List[str]) -> str:
+        """
+        Submit resumes to the Message Batches API for offline analysis
+        
+        Batched requests cost half as much and don't count against the
+        interactive rate limit, but results arrive asynchronously.
+        Each request's custom_id is the resume's index in resume_texts.
+        
+        Returns:
+            str: The batch id to pass to poll_batch
+        """
+        batch = self.client.messages.batches.create(requests=[
+            Request(custom_id=str(i), params=self._analysis_params(text))
+            for i, text in enumerate(resume_texts)
+        ])
+        return batch.id
+    
+    def poll_batch(self, batch_id: str, poll_interval: float = BATCH_POLL_INTERVAL,
+                   timeout: float = None) -> Dict[str, Dict]:
+        """
+        Wait for a submitted batch to finish and collect its analyses
+        
+        Returns:
+            dict: Analyses keyed by custom_id (failed requests and responses
+                without a tool call are omitted),
+                or None if the batch is still processing when timeout expires
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.client.messages.batches.retrieve(batch_id).processing_status != "ended":
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            time.sleep(poll_interval)
+        
+        analyses = {}
+        for entry in self.client.messages.batches.results(batch_id):
+            if entry.result.type != "succeeded":
+                continue
+            analysis = next(
+                (block.input for block in entry.result.message.content if block.type == "tool_use"),
+                None
+            )
+            # e.g. the response hit max_tokens before the tool call was emitted
+            if analysis is not None:
+                analyses[entry.custom_id] = analysis
+        return analyses
 
 class JobMatcher:
     def __init__(self, api_key: str):
         self.api_key = api_key
         self.headers = {
             "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
+            "Content-Type": "application/json",
+            # Ask for compressed payloads; urllib3 only lists br when it can decode it
+            "Accept-Encoding": ACCEPT_ENCODING
         }
+        # Auth headers are passed per request: the pooled session is shared
+        # across all users of the app
+        self.session = get_session()
+        self._cache_namespace = hashlib.sha256(api_key.encode()).hexdigest()
     
     def search_jobs(self, query: Dict) -> List[Dict]:
-        """Search jobs using TheirStack API"""
+        """Search jobs using TheirStack API (complete responses are cached for 10 minutes)"""
         # Translate our internal query format to the API's expected format
         api_query = self._format_search_query(query)
         
+        # Callers annotate the returned jobs in place, so hand out copies
+        search_cache, _, cache_lock = get_theirstack_caches()
+        cache_key = (self._cache_namespace, json.dumps(api_query, sort_keys=True))
+        with cache_lock:
+            cached = search_cache.get(cache_key)
+        if cached is not None:
+            return copy.deepcopy(cached)
+        
         try:
             # Log the query for debugging
             print(f"Sending search query: {json.dumps(api_query)}")
             
-            response = requests.post(
-                f"{THEIRSTACK_API_URL}/jobs/search",
-                headers=self.headers,
-                json=api_query
-            )
-            
-            # If there's an error, print more details
-            if response.status_code != 200:
-                print(f"API Response: {response.status_code} - {response.text}")
-                
-            response.raise_for_status()
-            return response.json()
+            jobs, complete = asyncio.run(self._fetch_all_pages(api_query))
         except Exception as e:
             st.error(f"Error searching jobs: {e}")
             return []
+        
+        # A partial result isn't cached, so the next search retries the failed pages
+        if complete:
+            with cache_lock:
+                search_cache[cache_key] = jobs
+        else:
+            st.warning("Some result pages could not be fetched; showing partial results.")
+        return copy.deepcopy(jobs)
+    
+    async def _fetch_all_pages(self, api_query: Dict) -> Tuple[List[Dict], bool]:
+        """
+        Fetch up to THEIRSTACK_MAX_PAGES pages of results
+        
+        The first page reports the total result count; the remaining pages
+        are then requested concurrently and merged in page order. A failed
+        later page is logged and skipped rather than failing the search.
+        
+        Returns:
+            tuple: (jobs, whether every page was fetched)
+        """
+        loop = asyncio.get_running_loop()
+        first_page = await loop.run_in_executor(None, self._fetch_page, api_query, 0)
+        jobs = self._extract_jobs(first_page)
+        
+        total_results = 0
+        if isinstance(first_page, dict):
+            total_results = first_page.get("metadata", {}).get("total_results") or 0
+        n_pages = min(math.ceil(total_results / THEIRSTACK_PAGE_SIZE), THEIRSTACK_MAX_PAGES)
+        
+        semaphore = asyncio.Semaphore(THEIRSTACK_MAX_CONCURRENCY)
+        
+        async def fetch(page: int):
+            async with semaphore:
+                return await loop.run_in_executor(None, self._fetch_page, api_query, page)
+        
+        pages = await asyncio.gather(
+            *(fetch(page) for page in range(1, n_pages)), return_exceptions=True
+        )
+        complete = True
+        for page, payload in enumerate(pages, 1):
+            if isinstance(payload, Exception):
+                print(f"Failed to fetch page {page}: {payload}")
+                complete = False
+                continue
+            jobs.extend(self._extract_jobs(payload))
+        return jobs, complete
+    
+    def _fetch_page(self, api_query: Dict, page: int) -> Any:
+        """Request a single page of search results"""
+        page_query = {
+            **api_query,
+            "page": page,
+            "limit": THEIRSTACK_PAGE_SIZE,
+            "include_total_results": page == 0
+        }
+        response = self.session.post(
+            f"{THEIRSTACK_API_URL}/jobs/search",
+            headers=self.headers,
+            json=page_query,
+            timeout=THEIRSTACK_TIMEOUT
+        )
+        
+        # If there's an error, print more details
+        if response.status_code != 200:
+            print(f"API Response: {response.status_code} - {response.text}")
+            
+        response.raise_for_status()
+        return orjson.loads(response.content)
+    
+    @staticmethod
+    def _extract_jobs(payload: Any) -> List[Dict]:
+        """Pull the job list out of a search response ({"metadata": ..., "data": [...]}), normalizing skills"""
+        jobs = payload.get("data", []) if isinstance(payload, dict) else payload
+        for job in jobs:
+            if job.get("required_skills"):
+                job["required_skills"] = normalize_skills(job["required_skills"])
+        return jobs
     
     def _format_search_query(self, query: Dict) -> Dict:
         """Format the query according to TheirStack API expectations"""
-        # Build a properly formatted query with required fields
-        formatted_query = {}
+        company = query.get("company")
+        title = query.get("title")
+        location = query.get("location")
+        skills = query.get("skills")
+        experience_level = query.get("experience_level")
         
+        # Build a properly formatted query with required fields
         # IMPORTANT: At least one of these filters is REQUIRED
         # Map date_posted to API format and convert to required filter
-        date_posted = query.get("date_posted")
-        if date_posted == "Last 24 hours":
-            formatted_query["posted_at_max_age_days"] = 1
-        elif date_posted == "Last 7 days":
-            formatted_query["posted_at_max_age_days"] = 7
-        elif date_posted == "Last 30 days":
-            formatted_query["posted_at_max_age_days"] = 30
-        else:
-            # Default to 90 days if no specific time frame is selected
-            formatted_query["posted_at_max_age_days"] = 90
+        formatted_query = {
+            "posted_at_max_age_days": DATE_POSTED_MAX_AGE_DAYS.get(query.get("date_posted"), 90)
+        }
         
         # Add company name filter if provided (this is one of the required filters)
-        if query.get("company"):
-            formatted_query["company_name_or"] = [query.get("company")]
+        if company:
+            formatted_query["company_name_or"] = [company]
         
         # Add other optional filters
-        if query.get("title"):
-            formatted_query["job_title_contains_any"] = [query.get("title")]
+        if title:
+            formatted_query["job_title_contains_any"] = [title]
         
-        if query.get("location"):
-            formatted_query["location_contains_any"] = [query.get("location")]
+        if location:
+            formatted_query["location_contains_any"] = [location]
         
         # Remote work filter
         if query.get("remote") is True:
             formatted_query["remote_contains_any"] = ["true"]
         
         # Add skills if available - using the appropriate API field name
-        if query.get("skills"):
-            skills = query.get("skills")
-            if isinstance(skills, list) and skills:
-                formatted_query["technologies_contains_any"] = skills
+        if skills and isinstance(skills, list):
+            formatted_query["technologies_contains_any"] = skills
         
         # Add experience level if available
-        if query.get("experience_level"):
-            level = query.get("experience_level").lower()
-            if level in ["entry", "mid", "senior"]:
+        if experience_level:
+            level = experience_level.lower()
+            if level in SENIORITY_LEVELS:
                 formatted_query["seniority_contains_any"] = [level]
         
         return formatted_query
     
-    def calculate_match_score(self, job: Dict, candidate_skills: List[str]) -> float:
-        """Calculate match score between job and candidate skills"""
+    @staticmethod
+    def calculate_match_score(job: Dict, cand_set: frozenset) -> float:
+        """Calculate match score between job and a prebuilt candidate skill set"""
         required_skills = set(job.get("required_skills", []))
-        candidate_skills = set(candidate_skills)
         
         if not required_skills:
             return 0.0
         
-        matches = required_skills.intersection(candidate_skills)
+        matches = required_skills.intersection(cand_set)
         score = len(matches) / len(required_skills) * 100
         return round(score, 2)
-
-def process_uploaded_file(uploaded_file):
-    """Extract text from uploaded resume file"""
-    if uploaded_file is None:
-        return None
     
-    file_extension = uploaded_file.name.split('.')[-1].lower()
+    @staticmethod
+    def score_jobs(jobs: List[Dict], cand_set: frozenset) -> None:
+        """
+        Set match_score on every job
+        
+        Skills are normalized and interned at ingestion, so each job costs one
+        C-level set intersection. This beats building per-job int bitmasks,
+        whose mask construction is a Python loop over every required skill.
+        """
+        for job in jobs:
+            job["match_score"] = JobMatcher.calculate_match_score(job, cand_set)
+
+def _extract_docx_text(docx_file) -> str:
+    """Read paragraph text straight from word/document.xml, skipping python-docx's full package load"""
+    with zipfile.ZipFile(docx_file) as archive:
+        root = ElementTree.fromstring(archive.read("word/document.xml"))
     
+    return "\n".join(
+        "".join(node.text or "" for node in paragraph.iter(f"{DOCX_NAMESPACE}t"))
+        for paragraph in root.iter(f"{DOCX_NAMESPACE}p")
+    )
+
+@st.cache_resource(show_spinner=False)
+def get_analyzer(api_key: str) -> ResumeAnalyzer:
+    """Build the ResumeAnalyzer (and its Anthropic client) once per API key"""
+    return ResumeAnalyzer(api_key)
+
+@st.cache_resource(show_spinner=False)
+def get_matcher(api_key: str) -> JobMatcher:
+    """Build the JobMatcher once per API key"""
+    return JobMatcher(api_key)
+
+@st.cache_data(show_spinner=False)
+def process_uploaded_file(file_bytes: bytes, file_extension: str):
+    """Extract text from an uploaded resume's bytes (cached on bytes + extension)"""
     try:
         if file_extension == 'pdf':
-            pdf_reader = PyPDF2.PdfReader(uploaded_file)
-            text = ""
+            pdf_reader = pypdf.PdfReader(io.BytesIO(file_bytes))
+            parts = []
+            length = 0
             for page in pdf_reader.pages:
-                text += page.extract_text()
-            return text
+                page_text = page.extract_text() or ""
+                parts.append(page_text)
+                length += len(page_text)
+                if length >= MAX_RESUME_CHARS:
+                    break
+            return "".join(parts)
             
         elif file_extension == 'docx':
-            doc = docx.Document(uploaded_file)
+            if len(file_bytes) > LARGE_DOCX_BYTES:
+                return _extract_docx_text(io.BytesIO(file_bytes))
+            
+            doc = docx.Document(io.BytesIO(file_bytes))
             text = "\n".join([paragraph.text for paragraph in doc.paragraphs])
             return text
             
         elif file_extension == 'txt':
-            return uploaded_file.read().decode('utf-8')
+            return file_bytes.decode('utf-8')
             
         else:
             st.error(f"Unsupported file format: {file_extension}")
@@ -204,29 +680,64 @@ def process_uploaded_file(uploaded_file):
         st.error(f"Error processing file: {e}")
         return None
 
-def create_match_visualization(jobs: List[Dict]):
-    """Create visualization of job matches"""
-    if not jobs:
-        return None
+def _call_with_script_ctx(ctx, func, *args):
+    """Run func in a worker thread attached to the caller's Streamlit script context"""
+    add_script_run_ctx(threading.current_thread(), ctx)
+    return func(*args)
+
+def extract_texts_in_background(uploaded_files) -> List[str]:
+    """
+    Extract text from uploaded files on the shared parsing pool
     
-    # Create bar chart of top matches
-    companies = [f"{job['company']} - {job['title']}" for job in jobs[:10]]
-    scores = [job['match_score'] for job in jobs[:10]]
+    The script thread polls the futures and updates a status line instead of
+    blocking, so Streamlit can still interrupt the run (e.g. on a new upload).
     
-    fig, ax = plt.subplots(figsize=(10, 6))
-    bars = ax.barh(companies, scores, color='skyblue')
+    Returns:
+        list: Extracted text per file in upload order (None where extraction failed)
+    """
+    ctx = get_script_run_ctx()
+    executor = get_executor()
+    futures = [
+        executor.submit(
+            _call_with_script_ctx, ctx, process_uploaded_file,
+            uploaded_file.getvalue(), uploaded_file.name.split('.')[-1].lower()
+        )
+        for uploaded_file in uploaded_files
+    ]
     
-    ax.set_xlabel('Match Score (%)')
-    ax.set_title('Top Job Matches')
+    status = st.empty()
+    start = time.monotonic()
+    while not all(future.done() for future in futures):
+        done = sum(future.done() for future in futures)
+        status.caption(f"{done}/{len(futures)} files processed ({time.monotonic() - start:.0f}s)")
+        time.sleep(0.1)
+    status.empty()
     
-    # Add score labels
-    for i, bar in enumerate(bars):
-        width = bar.get_width()
-        ax.text(width, bar.get_y() + bar.get_height()/2,
-                f'{scores[i]}%', ha='left', va='center')
+    return [future.result() for future in futures]
+
+async def run_pipeline(analyzer: ResumeAnalyzer, matcher: JobMatcher,
+                       resume_text: str, query: Dict) -> Tuple[Dict, List[Dict]]:
+    """
+    Analyze the resume and search for jobs concurrently
     
-    plt.tight_layout()
-    return fig
+    The two calls are independent once the search no longer filters on the
+    extracted skills, so wall-clock latency is the slower of the two rather
+    than their sum. Jobs are re-scored locally against the analysis in Step 4.
+    
+    Returns:
+        tuple: (analysis, jobs)
+    """
+    loop = asyncio.get_running_loop()
+    ctx = get_script_run_ctx()
+    analysis, jobs = await asyncio.gather(
+        loop.run_in_executor(None, _call_with_script_ctx, ctx, analyzer.analyze_resume, resume_text),
+        loop.run_in_executor(None, _call_with_script_ctx, ctx, matcher.search_jobs, query)
+    )
+    
+    # Normalized here rather than before caching, since interning doesn't survive pickling
+    if analysis:
+        analysis["technical_skills"] = normalize_skills(analysis.get("technical_skills", []))
+    return analysis, jobs
 
 def main():
     st.set_page_config(page_title="AI Job Matcher", layout="wide")
@@ -263,17 +774,114 @@ def main():
             os.environ["ANTHROPIC_API_KEY"] = claude_api_key
         if theirstack_api_key:
             os.environ["THEIRSTACK_API_KEY"] = theirstack_api_key
+        
+        bulk_mode = st.checkbox("Bulk mode", help="Analyze many CVs offline with the Message Batches API")
             
-        # Add API test button
+        # Add API test button; the last result stays on screen until it expires
+        # or the key changes
+        theirstack_key_hash = hashlib.sha256(theirstack_api_key.encode()).hexdigest()
         if theirstack_api_key and st.button("Test TheirStack API"):
             with st.spinner("Testing API connection..."):
-                success, message = test_theirstack_api(theirstack_api_key)
+                st.session_state.api_test_result = (
+                    theirstack_key_hash, *test_theirstack_api(theirstack_api_key)
+                )
+        
+        api_test_result = st.session_state.get("api_test_result")
+        if theirstack_api_key and api_test_result and api_test_result[0] == theirstack_key_hash:
+            _, success, message, checked_at = api_test_result
+            age = int(time.time() - checked_at)
+            if age < API_TEST_CACHE_SECONDS:
+                if age:
+                    message = f"{message} (checked {age}s ago)"
                 if success:
                     st.success(message)
                 else:
                     st.error(message)
     
-    # Step 1: Upload and Analyze CV
+    # Bulk mode: offline analysis of many CVs, outside the step-by-step flow
+    if bulk_mode:
+        st.markdown("<h2 class='step-title'>Bulk CV Analysis</h2>", unsafe_allow_html=True)
+        
+        if not claude_api_key:
+            st.error("Please enter your Claude API key in the sidebar")
+            return
+        
+        analyzer = get_analyzer(claude_api_key)
+        uploaded_files = st.file_uploader("Upload CVs", type=["pdf", "docx", "txt"],
+                                          accept_multiple_files=True)
+        
+        # A handful of CVs is analyzed right away in one request; larger sets go
+        # through the cheaper, asynchronous Message Batches API
+        if (uploaded_files and len(uploaded_files) <= MAX_RESUME_BATCH_SIZE
+                and st.button("Analyze Now")):
+            with st.spinner("Analyzing CVs..."):
+                extracted_texts = extract_texts_in_background(uploaded_files)
+                named_texts = [
+                    (uploaded_file.name, resume_text)
+                    for uploaded_file, resume_text in zip(uploaded_files, extracted_texts)
+                    if resume_text
+                ]
+                analyses = analyzer.analyze_resumes_batch([text for _, text in named_texts])
+            
+            st.session_state.bulk_batch_id = None
+            st.session_state.bulk_results = [
+                (file_name, analysis)
+                for (file_name, _), analysis in zip(named_texts, analyses)
+                if analysis
+            ]
+        
+        if uploaded_files and st.button("Submit Batch"):
+            with st.spinner("Processing CVs..."):
+                file_names, resume_texts = [], []
+                extracted_texts = extract_texts_in_background(uploaded_files)
+                for uploaded_file, resume_text in zip(uploaded_files, extracted_texts):
+                    if resume_text:
+                        file_names.append(uploaded_file.name)
+                        resume_texts.append(resume_text)
+            
+            if resume_texts:
+                try:
+                    st.session_state.bulk_batch_id = analyzer.submit_batch(resume_texts)
+                    st.session_state.bulk_file_names = file_names
+                    st.session_state.bulk_results = None
+                except Exception as e:
+                    st.error(f"Error submitting batch: {e}")
+        
+        # Results live in session state so later reruns don't have to poll again
+        batch_id = st.session_state.get("bulk_batch_id")
+        if batch_id and st.session_state.get("bulk_results") is None:
+            st.info(f"Batch {batch_id} submitted")
+            if st.button("Fetch Results"):
+                with st.spinner("Waiting for batch results..."):
+                    try:
+                        analyses = analyzer.poll_batch(batch_id, timeout=BATCH_POLL_TIMEOUT)
+                    except Exception as e:
+                        st.error(f"Error fetching batch results: {e}")
+                        return
+                
+                if analyses is None:
+                    st.warning("The batch is still processing. Try again later.")
+                else:
+                    file_names = st.session_state.get("bulk_file_names", [])
+                    st.session_state.bulk_results = [
+                        (file_names[int(custom_id)], analysis)
+                        for custom_id, analysis in sorted(analyses.items(), key=lambda item: int(item[0]))
+                    ]
+        
+        bulk_results = st.session_state.get("bulk_results")
+        if bulk_results is not None:
+            st.dataframe(pd.DataFrame([
+                {
+                    "CV": file_name,
+                    "Technical Skills": ", ".join(analysis.get("technical_skills", [])),
+                    "Years": analysis.get("years_experience"),
+                    "Level": analysis.get("seniority_level")
+                }
+                for file_name, analysis in bulk_results
+            ]))
+        return
+    
+    # Step 1: Upload CV (analysis runs alongside the job search in Step 3)
     if st.session_state.step == 1:
         st.markdown("<h2 class='step-title'>Step 1: Upload Your CV</h2>", unsafe_allow_html=True)
         
@@ -281,41 +889,14 @@ def main():
         
         if uploaded_file:
             with st.spinner("Processing your CV..."):
-                resume_text = process_uploaded_file(uploaded_file)
+                resume_text = extract_texts_in_background([uploaded_file])[0]
                 if resume_text:
-                    if not claude_api_key:
-                        st.error("Please enter your Claude API key in the sidebar")
-                    else:
-                        analyzer = ResumeAnalyzer(claude_api_key)
-                        analysis = analyzer.analyze_resume(resume_text)
-                        
-                        if analysis:
-                            st.success("CV analyzed successfully!")
-                            st.session_state.resume_analysis = analysis
-                            
-                            # Display extracted information
-                            col1, col2 = st.columns(2)
-                            
-                            with col1:
-                                st.subheader("Technical Skills")
-                                st.write(", ".join(analysis["technical_skills"]))
-                                
-                                st.subheader("Experience")
-                                st.write(f"Years: {analysis['years_experience']}")
-                                st.write(f"Level: {analysis['seniority_level']}")
-                            
-                            with col2:
-                                st.subheader("Education")
-                                for edu in analysis["education"]:
-                                    st.write(f"• {edu}")
-                                
-                                st.subheader("Key Achievements")
-                                for achievement in analysis["achievements"]:
-                                    st.write(f"• {achievement}")
-                            
-                            if st.button("Continue to Job Preferences"):
-                                st.session_state.step = 2
-                                st.rerun()
+                    st.success("CV uploaded successfully!")
+                    st.session_state.resume_text = resume_text
+                    
+                    if st.button("Continue to Job Preferences"):
+                        st.session_state.step = 2
+                        st.rerun()
     
     # Step 2: Set Job Preferences
     elif st.session_state.step == 2:
@@ -352,35 +933,61 @@ def main():
     elif st.session_state.step == 3:
         st.markdown("<h2 class='step-title'>Step 3: Searching for Jobs</h2>", unsafe_allow_html=True)
         
-        if not theirstack_api_key:
+        if not claude_api_key:
+            st.error("Please enter your Claude API key in the sidebar")
+        elif not theirstack_api_key:
             st.error("Please enter your TheirStack API key in the sidebar")
         else:
-            with st.spinner("Searching for matching jobs..."):
-                matcher = JobMatcher(theirstack_api_key)
+            with st.spinner("Analyzing your CV and searching for matching jobs..."):
+                analyzer = get_analyzer(claude_api_key)
+                matcher = get_matcher(theirstack_api_key)
                 
                 # Prepare search query
-                analysis = st.session_state.get("resume_analysis", {})
+                resume_text = st.session_state.get("resume_text", "")
                 preferences = st.session_state.get("job_preferences", {})
                 
-                # Create a query that meets the API requirements
+                # Create a query that meets the API requirements. Skills and
+                # seniority are left out so the search doesn't have to wait
+                # for the resume analysis; jobs are scored locally instead.
                 search_query = {
                     "title": preferences.get("title", ""),
                     "location": preferences.get("location", ""),
                     "company": preferences.get("company", ""),
                     "remote": preferences.get("remote") == "Remote only",
-                    "date_posted": preferences.get("date_posted", "Last 30 days"),
-                    "skills": analysis.get("technical_skills", []),
-                    "experience_level": analysis.get("seniority_level", "")
+                    "date_posted": preferences.get("date_posted", "Last 30 days")
                 }
                 
                 # For debugging
                 st.write("Debug - Search Query:", search_query)
                 
                 try:
-                    jobs = matcher.search_jobs(search_query)
+                    analysis, jobs = asyncio.run(
+                        run_pipeline(analyzer, matcher, resume_text, search_query)
+                    )
+                    
+                    if not analysis:
+                        st.error("Could not analyze your CV")
+                        if st.button("Upload a Different CV"):
+                            st.session_state.step = 1
+                            st.rerun()
+                        return
+                    
+                    st.session_state.resume_analysis = analysis
                     
                     if jobs:
+                        # Score, sort and collect filter options once here
+                        # rather than on every Step 4 rerun
+                        cand_set = frozenset(analysis.get("technical_skills", []))
+                        JobMatcher.score_jobs(jobs, cand_set)
+                        jobs.sort(key=lambda x: x["match_score"], reverse=True)
+                        
                         st.session_state.jobs = jobs
+                        st.session_state.locations = sorted(
+                            {job["location"] for job in jobs if job.get("location")}
+                        )
+                        st.session_state.remote_types = sorted(
+                            {job["remote_type"] for job in jobs if job.get("remote_type")}
+                        )
                         st.session_state.step = 4
                         st.rerun()
                     else:
@@ -409,31 +1016,47 @@ def main():
             st.error("No job matches found")
             return
         
-        # Calculate match scores
-        matcher = JobMatcher(theirstack_api_key)
-        candidate_skills = analysis.get("technical_skills", [])
-        
-        for job in jobs:
-            job["match_score"] = matcher.calculate_match_score(job, candidate_skills)
+        # Display extracted CV information
+        with st.expander("Your CV Analysis"):
+            col1, col2 = st.columns(2)
+            
+            with col1:
+                st.subheader("Technical Skills")
+                st.write(", ".join(analysis["technical_skills"]))
+                
+                st.subheader("Experience")
+                st.write(f"Years: {analysis['years_experience']}")
+                st.write(f"Level: {analysis['seniority_level']}")
+            
+            with col2:
+                st.subheader("Education")
+                for edu in analysis["education"]:
+                    st.write(f"• {edu}")
+                
+                st.subheader("Key Achievements")
+                for achievement in analysis["achievements"]:
+                    st.write(f"• {achievement}")
         
-        # Sort by match score
-        jobs.sort(key=lambda x: x["match_score"], reverse=True)
+        # Jobs were scored and sorted when they were stored in Step 3
+        cand_set = frozenset(analysis.get("technical_skills", []))
         
-        # Create visualization
-        fig = create_match_visualization(jobs)
-        if fig:
-            st.pyplot(fig)
+        # Create visualization. Labels carry the rank so postings with the same
+        # company and title stay separate bars instead of stacking.
+        top_jobs = jobs[:10]
+        chart_data = pd.DataFrame(
+            {"Match Score (%)": [job['match_score'] for job in top_jobs]},
+            index=[f"{rank}. {job['company']} - {job['title']}" for rank, job in enumerate(top_jobs, 1)]
+        )
+        st.bar_chart(chart_data, horizontal=True, sort="-Match Score (%)")
         
         # Filters
         col1, col2, col3 = st.columns(3)
         with col1:
             min_score = st.slider("Minimum Match Score", 0, 100, 50)
         with col2:
-            location_filter = st.multiselect("Location", 
-                list(set(job.get("location", "") for job in jobs)))
+            location_filter = st.multiselect("Location", st.session_state.get("locations", []))
         with col3:
-            remote_filter = st.multiselect("Remote Type",
-                list(set(job.get("remote_type", "") for job in jobs if "remote_type" in job)))
+            remote_filter = st.multiselect("Remote Type", st.session_state.get("remote_types", []))
         
         # Apply filters
         filtered_jobs = [
@@ -443,36 +1066,46 @@ def main():
             and (not remote_filter or job.get("remote_type", "") in remote_filter)
         ]
         
-        # Display jobs
-        for job in filtered_jobs:
-            with st.container():
-                st.markdown(f"""
-                <div class="job-card">
-                    <h3>{job.get('title', 'Untitled')} at {job.get('company', 'Unknown')}</h3>
-                    <p>Location: {job.get('location', 'Not specified')}</p>
-                    <p>Match Score: <span class="match-score">{job['match_score']}%</span></p>
-                </div>
-                """, unsafe_allow_html=True)
+        # Display jobs as a single markdown element rather than one per job
+        st.markdown("".join(
+            JOB_CARD_TEMPLATE.format(
+                title=html.escape(str(job.get('title', 'Untitled'))),
+                company=html.escape(str(job.get('company', 'Unknown'))),
+                location=html.escape(str(job.get('location', 'Not specified'))),
+                match_score=job['match_score']
+            )
+            for job in filtered_jobs
+        ), unsafe_allow_html=True)
+        
+        # Only the job the user picks gets its details rendered
+        selected_job = st.selectbox(
+            "View Details",
+            filtered_jobs,
+            index=None,
+            format_func=lambda job: f"{job.get('title', 'Untitled')} at {job.get('company', 'Unknown')}",
+            placeholder="Select a job to see its details"
+        )
+        
+        if selected_job:
+            with st.container(border=True):
+                st.markdown("### Job Description")
+                st.write(selected_job.get("description", "No description available"))
                 
-                with st.expander("View Details"):
-                    st.markdown("### Job Description")
-                    st.write(job.get("description", "No description available"))
-                    
-                    st.markdown("### Required Skills")
-                    if "required_skills" in job and job["required_skills"]:
-                        st.write(", ".join(job["required_skills"]))
-                    else:
-                        st.write("No specific skills listed")
-                    
-                    st.markdown("### Your Matching Skills")
-                    matching_skills = set(job.get("required_skills", [])) & set(candidate_skills)
-                    if matching_skills:
-                        st.write(", ".join(matching_skills))
-                    else:
-                        st.write("No direct skill matches")
-                    
-                    if "apply_url" in job:
-                        st.markdown(f"[Apply Now]({job['apply_url']})")
+                st.markdown("### Required Skills")
+                if "required_skills" in selected_job and selected_job["required_skills"]:
+                    st.write(", ".join(selected_job["required_skills"]))
+                else:
+                    st.write("No specific skills listed")
+                
+                st.markdown("### Your Matching Skills")
+                matching_skills = cand_set.intersection(selected_job.get("required_skills", []))
+                if matching_skills:
+                    st.write(", ".join(matching_skills))
+                else:
+                    st.write("No direct skill matches")
+                
+                if "apply_url" in selected_job:
+                    st.markdown(f"[Apply Now]({selected_job['apply_url']})")
         
         # Button to start over
         if st.button("Start Over"):